@@ -1,5 +1,8 @@
 # collect_urls.py — remplit urls.csv depuis les sitemaps (6 sites)
-import re, requests, xml.etree.ElementTree as ET
+import re, asyncio, aiohttp
+from io import BytesIO
+from lxml import etree
+from xxhash import xxh64_intdigest
 
 SITES = [
     ("alltricks.fr",   "https://www.alltricks.fr/sitemap.xml",         r"/(p|produit|product|fiche)/"),
@@ -9,45 +12,81 @@ SITES = [
     ("fnac.com",       "https://www.fnac.com/sitemap.xml",             r"/(a/|p/|ProductDetail)"),
     ("boulanger.com",  "https://www.boulanger.com/sitemap.xml",        r"/(ref|product|fiche-produit)"),
 ]
+# motifs compilés une fois pour toutes à l'import
+SITES = [(domain, rootmap, re.compile(pattern, re.I)) for domain, rootmap, pattern in SITES]
 
 HEADERS = {"User-Agent": "Mozilla/5.0 (compatible; DetecteurPrixBot/1.0)"}
 
-def fetch(url):
-    r = requests.get(url, timeout=40, headers=HEADERS); r.raise_for_status()
-    return r.text
+WORKERS_PER_SITE = 10   # sous-sitemaps d'un même site lus en parallèle
+MAX_FETCHES      = 64   # téléchargements simultanés, tous sites confondus
 
-def parse_sitemap(url):
-    xml = fetch(url)
-    root = ET.fromstring(xml)
-    return [e.text.strip() for e in root.iter("{*}loc")]
+async def fetch(session, sem, url):
+    async with sem:
+        async with session.get(url) as r:
+            r.raise_for_status()
+            return await r.read()
 
-def main(max_per_site=150):  # augmente ensuite si tu veux
-    all_urls = []
-    for domain, rootmap, pattern in SITES:
-        rx = re.compile(pattern, re.I)
-        to_visit, seen, found = [rootmap], set(), []
-        while to_visit and len(found) < max_per_site:
-            sm = to_visit.pop()
-            if sm in seen: continue
-            seen.add(sm)
+def parse_sitemap(xml):
+    # générateur sur les <loc> ; l'arbre est élagué au fil de la lecture :
+    # les <url>/<sitemap> déjà traités (lastmod, image:*...) sont supprimés
+    for _, e in etree.iterparse(BytesIO(xml), tag="{*}loc"):
+        if e.text: yield e.text.strip()
+        e.clear()
+        node = e   # remonte jusqu'à l'enfant direct de la racine (<url>/<sitemap>)
+        while node.getparent() is not None and node.getparent().getparent() is not None:
+            node = node.getparent()
+        while node.getprevious() is not None:
+            del node.getparent()[0]
+
+async def crawl_site(session, sem, rootmap, rx, limit):
+    search = rx.search
+    queue, seen, found = asyncio.Queue(), set(), []   # seen : empreintes xxh64
+    queue.put_nowait(rootmap)
+
+    async def worker():
+        while True:
+            sm = await queue.get()
             try:
-                locs = parse_sitemap(sm)
+                h = xxh64_intdigest(sm.encode())
+                if h in seen or len(found) >= limit: continue
+                seen.add(h)
+                xml = await fetch(session, sem, sm)
+                for loc in parse_sitemap(xml):
+                    if loc.endswith(".xml"):
+                        queue.put_nowait(loc)    # sitemap enfant
+                    elif search(loc):
+                        # un autre worker a pu remplir found pendant le fetch
+                        if len(found) >= limit: break
+                        found.append(loc)
             except Exception:
-                continue
-            for loc in locs:
-                if loc.endswith(".xml"):
-                    to_visit.append(loc)     # sitemap enfant
-                elif rx.search(loc):
-                    found.append(loc)
-                    if len(found) >= max_per_site: break
+                pass
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(WORKERS_PER_SITE)]
+    await queue.join()
+    for w in workers: w.cancel()
+    return found
+
+async def collect(max_per_site):
+    sem = asyncio.BoundedSemaphore(MAX_FETCHES)
+    async with aiohttp.ClientSession(headers=HEADERS,
+                                     timeout=aiohttp.ClientTimeout(total=40)) as session:
+        return await asyncio.gather(*(crawl_site(session, sem, rootmap, rx, max_per_site)
+                                      for _, rootmap, rx in SITES))
+
+def main(max_per_site=150):  # augmente ensuite si tu veux
+    all_urls = []
+    for (domain, _, _), found in zip(SITES, asyncio.run(collect(max_per_site))):
         print(f"{domain}: {len(found)} URLs")
         all_urls.extend(found)
 
-    # dédup + écriture
+    # dédup (sur empreintes xxh64) + écriture
     seen, out = set(), []
     for u in all_urls:
-        if u not in seen:
-            seen.add(u); out.append(u)
+        h = xxh64_intdigest(u.encode())
+        if h not in seen:
+            seen.add(h); out.append(u)
 
     with open("urls.csv", "w", encoding="utf-8") as f:
         f.write("url,nom\n")
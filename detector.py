@@ -3,10 +3,36 @@
 # - lit urls.csv (généré par collect_urls.py)
 # - extrait le prix (JSON-LD, meta, ou sélecteurs de secours)
 # - enregistre l'historique (SQLite prix.db)
+# - requêtes conditionnelles (ETag / Last-Modified) : page inchangée = prix repris
 # - alerte si prix < 1 € ou très bas vs historique (Médiane+MAD)
 
-import csv, os, re, json, time, sqlite3, requests
-from bs4 import BeautifulSoup
+import csv, os, re, json, time, random, sqlite3, asyncio, requests, aiohttp
+import numpy as np
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import parsedate_to_datetime
+from itertools import chain
+from urllib.parse import urlparse
+
+# Parseur HTML : selectolax/Lexbor si disponible, sinon BeautifulSoup
+# (avec lxml en C si possible, sinon html.parser en pur Python)
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+    from bs4 import BeautifulSoup
+    try:
+        import lxml  # noqa: F401
+        BS_PARSER = "lxml"
+    except ImportError:
+        BS_PARSER = "html.parser"
+
+# Décodage JSON-LD : orjson (C) si disponible, sinon json
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 CSV_URLS = "urls.csv"
 DB_FILE = "prix.db"
@@ -18,6 +44,13 @@ ABS_FLOOR  = 1.00     # alerte immédiate si prix < 1.00 €
 
 HEADERS = {"User-Agent": "Mozilla/5.0 (compatible; DetecteurPrixBot/1.0)"}
 
+# Téléchargements concurrents
+CONCURRENCY = 64      # connexions simultanées au total (borne du TCPConnector)
+PER_HOST    = 4       # requêtes simultanées par domaine
+TIMEOUT_S   = 40
+JITTER_S    = (0.2, 1.0)  # pause aléatoire avant chaque requête
+MAX_TRIES   = 4       # tentatives sur 429 / 5xx (backoff exponentiel)
+
 # Sélecteurs de secours par domaine
 SELECTEURS_PAR_SITE = {
     "alltricks.fr":   ["[itemprop=price]", "[class*=price]"],
@@ -29,13 +62,18 @@ SELECTEURS_PAR_SITE = {
 }
 
 # ---------- Envoi Telegram ----------
+# Session partagée : la connexion TLS vers api.telegram.org est réutilisée
+# d'une alerte à l'autre (les pages produit passent par aiohttp).
+TG_SESSION = requests.Session()
+TG_SESSION.headers.update(HEADERS)
+
 def send_telegram(text: str):
     token = os.getenv("TELEGRAM_TOKEN")
     chat_id = os.getenv("TELEGRAM_CHAT_ID")
     if not token or not chat_id:
         print("Telegram non configuré."); return
     try:
-        resp = requests.post(
+        resp = TG_SESSION.post(
             f"https://api.telegram.org/bot{token}/sendMessage",
             json={"chat_id": chat_id, "text": text, "disable_web_page_preview": True},
             timeout=15
@@ -46,15 +84,42 @@ def send_telegram(text: str):
         print("Erreur envoi Telegram:", e)
 
 # ---------- Extraction du prix ----------
+_NUM_RE = re.compile(r'(\d+(?:[.,]\d+)?)')
+
 def _to_number(txt: str) -> float:
-    m = re.search(r'(\d+(?:[.,]\d+)?)', txt)
+    m = _NUM_RE.search(txt)
     if not m: raise ValueError(f"Nombre introuvable dans {txt!r}")
     return float(m.group(1).replace(",", "."))
 
-def _jsonld_prices(soup):
-    for tag in soup.select('script[type="application/ld+json"]'):
+def _parse_html(html):
+    if LexborHTMLParser is not None:
+        return LexborHTMLParser(html)
+    return BeautifulSoup(html, BS_PARSER)
+
+def _css(doc, sel):
+    return doc.css(sel) if LexborHTMLParser is not None else doc.select(sel)
+
+def _tags(doc, name):
+    # parcours par nom de balise, sans passer par le moteur de sélecteurs CSS
+    return doc.tags(name) if LexborHTMLParser is not None else doc.find_all(name)
+
+def _attr(el, name):
+    return el.attributes.get(name) if LexborHTMLParser is not None else el.get(name)
+
+def _text(el):
+    if LexborHTMLParser is not None:
+        return el.text(separator=" ", strip=True)
+    return el.get_text(" ", strip=True)
+
+def _raw_text(el):
+    # contenu brut d'un <script> ; str() car orjson refuse NavigableString
+    return el.text() if LexborHTMLParser is not None else str(el.string or "")
+
+def _jsonld_prices(doc):
+    for tag in _tags(doc, "script"):
+        if _attr(tag, "type") != "application/ld+json": continue
         try:
-            data = json.loads(tag.string or "")
+            data = json_loads(_raw_text(tag) or "")
         except Exception:
             continue
         blocks = data if isinstance(data, list) else [data]
@@ -72,36 +137,73 @@ def _jsonld_prices(soup):
             if b.get("@type") == "Offer" and b.get("price") is not None:
                 yield str(b["price"])
 
-def _meta_prices(soup):
-    metas = [
-        ('meta[itemprop="price"]', "content"),
-        ('meta[property="product:price:amount"]', "content"),
-        ('meta[name="price"]', "content"),
-    ]
-    for sel, attr in metas:
-        for el in soup.select(sel):
-            v = el.get(attr)
-            if v: yield v
-
-def _text_prices(soup, host):
+# <meta content="..."> porteurs de prix, par ordre de priorité
+META_PRIX = [("itemprop", "price"), ("property", "product:price:amount"), ("name", "price")]
+
+def _meta_prices(doc):
+    # un seul passage sur les <meta>, restitués dans l'ordre de META_PRIX
+    buckets = [[] for _ in META_PRIX]
+    for el in _tags(doc, "meta"):
+        v = _attr(el, "content")
+        if not v: continue
+        for bucket, (attr, val) in zip(buckets, META_PRIX):
+            if _attr(el, attr) == val:
+                bucket.append(v); break
+    for bucket in buckets:
+        yield from bucket
+
+def _text_prices(doc, host):
     for sel in SELECTEURS_PAR_SITE.get(host, []):
-        for el in soup.select(sel): yield el.get_text(" ", strip=True)
+        for el in _css(doc, sel): yield _text(el)
     for sel in ("[class*=price]", "[id*=price]"):
-        for el in soup.select(sel): yield el.get_text(" ", strip=True)
+        for el in _css(doc, sel): yield _text(el)
+
+def _host_slot(slots, url):
+    # slots : {domaine: asyncio.BoundedSemaphore(PER_HOST)}, propre à chaque run
+    host = urlparse(url).netloc
+    if host not in slots:
+        slots[host] = asyncio.BoundedSemaphore(PER_HOST)
+    return slots[host]
 
-def extract_price(url: str) -> float:
+def _retry_delay(attempt, retry_after=None):
+    if retry_after:
+        try:
+            return min(60, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+        try:
+            return min(60, max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time()))
+        except (TypeError, ValueError):
+            pass
+    return min(60, 2 ** attempt) + random.random()
+
+async def fetch_html(session, host_slots, url: str, etag=None, last_modified=None):
+    # -> (html, etag, last_modified) ; html vaut None si la page n'a pas changé (304)
     if "amazon." in url:
         raise RuntimeError("Amazon: utiliser l'API Keepa (non activée ici).")
-    r = requests.get(url, timeout=40, headers=HEADERS)
-    r.encoding = r.encoding or "utf-8"
-    r.raise_for_status()
-    soup = BeautifulSoup(r.text, "html.parser")
-    host = re.sub(r"^https?://", "", url).split("/")[0].lower()
-
-    candidates = []
-    candidates += list(_jsonld_prices(soup))
-    candidates += list(_meta_prices(soup))
-    candidates += list(_text_prices(soup, host))
+    headers = {}
+    if etag: headers["If-None-Match"] = etag
+    if last_modified: headers["If-Modified-Since"] = last_modified
+    for attempt in range(MAX_TRIES):
+        async with _host_slot(host_slots, url):
+            await asyncio.sleep(random.uniform(*JITTER_S))
+            async with session.get(url, headers=headers) as r:
+                if r.status == 304:
+                    return None, etag, last_modified
+                if (r.status == 429 or r.status >= 500) and attempt < MAX_TRIES - 1:
+                    delay = _retry_delay(attempt, r.headers.get("Retry-After"))
+                else:
+                    r.raise_for_status()
+                    html = await r.text(errors="replace")
+                    return html, r.headers.get("ETag"), r.headers.get("Last-Modified")
+        await asyncio.sleep(delay)   # attente hors du créneau du domaine
+
+def parse_price(html: str, url: str) -> float:
+    doc = _parse_html(html)
+    host = urlparse(url).hostname or ""
+
+    # évaluation paresseuse : on s'arrête au premier prix valide
+    candidates = chain(_jsonld_prices(doc), _meta_prices(doc), _text_prices(doc, host))
     for c in candidates:
         try:
             return _to_number(c)
@@ -110,8 +212,17 @@ def extract_price(url: str) -> float:
     raise RuntimeError("Prix introuvable")
 
 # ---------- Stockage ----------
+# Une seule connexion par exécution : les écritures sont regroupées dans
+# une transaction, validée tous les BATCH_SIZE prix et en fin de run.
+BATCH_SIZE = 500
+
 def init_db():
     con = sqlite3.connect(DB_FILE)
+    con.execute("PRAGMA journal_mode=WAL")       # WAL : 1 écriture disque par commit
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute("PRAGMA mmap_size=268435456")    # 256 Mo
+    con.execute("PRAGMA cache_size=-65536")      # 64 Mo
     con.execute("""CREATE TABLE IF NOT EXISTS prices(
         url TEXT, name TEXT, ts INTEGER, price REAL
     )""")
@@ -119,58 +230,70 @@ def init_db():
     con.execute("""CREATE TABLE IF NOT EXISTS alerts(
         url TEXT, ts INTEGER, price REAL, msg TEXT
     )""")
-    con.commit(); con.close()
+    con.execute("""CREATE INDEX IF NOT EXISTS idx_alerts ON alerts(url, ts)""")
+    # validateurs HTTP de la dernière page lue, pour les requêtes conditionnelles
+    con.execute("""CREATE TABLE IF NOT EXISTS cache(
+        url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, ts INTEGER, price REAL
+    )""")
+    con.commit()
+    return con
 
-def save_price(url, name, price):
-    con = sqlite3.connect(DB_FILE)
-    con.execute("INSERT INTO prices(url,name,ts,price) VALUES(?,?,?,?)",
-                (url, name, int(time.time()), price))
-    con.commit(); con.close()
+def save_prices(con, rows):
+    # rows: [(url, name, ts, price), ...]
+    con.executemany("INSERT INTO prices(url,name,ts,price) VALUES(?,?,?,?)", rows)
 
-def recently_alerted(url, cooldown_h=12):
-    since = int(time.time()) - cooldown_h*3600
-    con = sqlite3.connect(DB_FILE)
-    row = con.execute("SELECT 1 FROM alerts WHERE url=? AND ts>=? LIMIT 1",
-                      (url, since)).fetchone()
-    con.close()
-    return bool(row)
+def save_alerts(con, rows):
+    # rows: [(url, ts, price, msg), ...]
+    con.executemany("INSERT INTO alerts(url,ts,price,msg) VALUES(?,?,?,?)", rows)
 
-def save_alert(url, price, msg):
-    con = sqlite3.connect(DB_FILE)
-    con.execute("INSERT INTO alerts(url,ts,price,msg) VALUES(?,?,?,?)",
-                (url, int(time.time()), price, msg))
-    con.commit(); con.close()
+def save_cache(con, rows):
+    # rows: [(url, etag, last_modified, ts, price), ...]
+    con.executemany("""INSERT OR REPLACE INTO cache(url,etag,last_modified,ts,price)
+                       VALUES(?,?,?,?,?)""", rows)
+
+def flush(con, pending_prices, pending_alerts, pending_cache):
+    if pending_prices:
+        save_prices(con, pending_prices)
+        pending_prices.clear()
+    if pending_alerts:
+        save_alerts(con, pending_alerts)
+        pending_alerts.clear()
+    if pending_cache:
+        save_cache(con, pending_cache)
+        pending_cache.clear()
+    con.commit()
+
+def load_cache(con):
+    # {url: (etag, last_modified, price)}
+    return {url: (etag, lm, price) for url, etag, lm, price in con.execute(
+        "SELECT url, etag, last_modified, price FROM cache")}
+
+def recently_alerted(con, cooldown_h=12):
+    # ensemble des URLs déjà alertées pendant le délai de carence
+    since = int(time.time()) - cooldown_h*3600
+    return {r[0] for r in con.execute(
+        "SELECT DISTINCT url FROM alerts WHERE ts>=?", (since,))}
 
-def load_history(url, days=90):
+def load_histories(con, days=90):
+    # {url: [prix, ...]} pour toutes les URLs, en une seule requête
     since = int(time.time()) - days*86400
-    con = sqlite3.connect(DB_FILE)
-    rows = con.execute(
-        "SELECT price FROM prices WHERE url=? AND ts>=? ORDER BY ts",
-        (url, since)
-    ).fetchall()
-    con.close()
-    return [r[0] for r in rows]
+    hist = defaultdict(list)
+    for url, price in con.execute(
+        "SELECT url, price FROM prices WHERE ts>=? ORDER BY url, ts", (since,)
+    ):
+        hist[url].append(price)
+    return hist
 
 # ---------- Stats & règle d'anomalie ----------
-def median(vals):
-    s = sorted(vals); n = len(s)
-    if n == 0: return None
-    m = n // 2
-    return s[m] if n % 2 else (s[m-1] + s[m]) / 2
-
-def mad(vals, med):
-    if med is None: return 1.0
-    devs = [abs(v - med) for v in vals]
-    m = median(devs)
-    return m if m not in (None, 0) else 1.0
-
 def is_anomaly(current, hist):
     if current < ABS_FLOOR:
         return True, f"ANOMALIE: {current:.2f} < {ABS_FLOOR:.2f} (seuil absolu)"
     if len(hist) < MIN_POINTS:
         return False, f"Pas assez d'historique ({len(hist)}/{MIN_POINTS})."
-    med = median(hist)
-    sigma = 1.4826 * mad(hist, med)    # écart-type robuste
+    a = np.asarray(hist, dtype=np.float64)
+    med = np.median(a)
+    mad = np.median(np.abs(a - med)) or 1.0
+    sigma = 1.4826 * mad               # écart-type robuste
     seuil_rel = REL_FACTOR * med
     seuil_rob = med - 3 * sigma
     seuil = max(seuil_rel, seuil_rob)
@@ -179,28 +302,62 @@ def is_anomaly(current, hist):
     return False, f"OK: {current:.2f} ≥ max({seuil_rel:.2f}, {seuil_rob:.2f}) (med={med:.2f})"
 
 # ---------- Main ----------
+async def run(con, rows):
+    loop = asyncio.get_running_loop()
+    host_slots = {}   # le total est borné par le TCPConnector, pas par un sémaphore
+    pending_prices, pending_alerts, pending_cache = [], [], []
+    alerted = recently_alerted(con)
+    histories = load_histories(con)
+    cache = load_cache(con)
+
+    async def process(row):
+        url = row["url"].strip()
+        name = (row.get("nom") or url).strip()
+        try:
+            etag, last_modified, price = cache.get(url, (None, None, None))
+            html, etag, last_modified = await fetch_html(session, host_slots, url, etag, last_modified)
+            if html is not None:
+                # analyse HTML (CPU) dans un processus séparé : la boucle reste libre
+                price = await loop.run_in_executor(pool, parse_price, html, url)
+            # sinon 304 : page inchangée, on reprend le prix du cache
+            if etag or last_modified:
+                pending_cache.append((url, etag, last_modified, int(time.time()), price))
+            hist = histories.get(url, [])   # chargé avant le run : prix passés uniquement
+            pending_prices.append((url, name, int(time.time()), price))
+            if len(pending_prices) >= BATCH_SIZE:
+                flush(con, pending_prices, pending_alerts, pending_cache)
+            anomaly, msg = is_anomaly(price, hist)  # compare au passé
+            line = (("⚠️ " if anomaly else "✅ ") +
+                    f"{name} | {price:.2f} | {msg} | {url}")
+            print(line)
+            if anomaly and url not in alerted:
+                alerted.add(url)   # avant l'await : pas de doublon pendant l'envoi
+                pending_alerts.append((url, int(time.time()), price, msg))
+                # envoi bloquant (requests) dans un thread : la boucle continue
+                await loop.run_in_executor(None, send_telegram,
+                                           "Anomalie de prix détectée ⚠️\n" + line)
+        except Exception as e:
+            print("❌", name, "|", url, "|", e)
+
+    connector = aiohttp.TCPConnector(limit=CONCURRENCY, limit_per_host=PER_HOST)
+    try:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+            async with aiohttp.ClientSession(connector=connector, headers=HEADERS,
+                                             timeout=aiohttp.ClientTimeout(total=TIMEOUT_S)) as session:
+                await asyncio.gather(*(process(row) for row in rows))
+    finally:
+        flush(con, pending_prices, pending_alerts, pending_cache)
+
 def main():
     if not os.path.exists(CSV_URLS):
         print("urls.csv manquant. Exécute d'abord collect_urls.py"); return
-    init_db()
     with open(CSV_URLS, newline="", encoding="utf-8") as f:
-        for row in csv.DictReader(f):
-            url = row["url"].strip()
-            name = (row.get("nom") or url).strip()
-            try:
-                price = extract_price(url)
-                save_price(url, name, price)
-                hist = load_history(url)
-                anomaly, msg = is_anomaly(price, hist[:-1])  # compare au passé
-                line = (("⚠️ " if anomaly else "✅ ") +
-                        f"{name} | {price:.2f} | {msg} | {url}")
-                print(line)
-                if anomaly and not recently_alerted(url):
-                    send_telegram("Anomalie de prix détectée ⚠️\n" + line)
-                    save_alert(url, price, msg)
-            except Exception as e:
-                print("❌", name, "|", url, "|", e)
+        rows = list(csv.DictReader(f))
+    con = init_db()
+    try:
+        asyncio.run(run(con, rows))
+    finally:
+        con.close()
 
 if __name__ == "__main__":
     main()
-